@@ -4,10 +4,20 @@
 # python compress_gallery.py --src .\gallery --dst .\gallery_5MB
 # python compress_gallery.py --src .\gallery --dst .\gallery_5MB --limit 5
 # python compress_gallery.py --src .\gallery --dst .\gallery_10MB --limit 10
+# python compress_gallery.py --src .\gallery --dst .\gallery_5MB --fast    # JPEG 编码约快一倍，体积略大
 
+# 加速（可选）：耗时几乎全在 JPEG/WebP 编码器里，可换成 Pillow-SIMD + libjpeg-turbo，代码无需改动
+#   Linux:  先装 libjpeg-turbo-dev（Debian/Ubuntu: apt install libjpeg-turbo8-dev）
+#           pip uninstall -y pillow && CC="cc -mavx2" pip install -U --force-reinstall pillow-simd
+#   PyPI 上的 pillow-simd 只有源码包，其他平台同样需要编译器和 libjpeg-turbo 从源码编译
+#   注意 pillow-simd 与 pillow 不能共存，之后再装依赖 pillow 的包可能会把它覆盖回去
+#   pillow-simd 的版本落后于 Pillow，没有 AVIF 支持：要用 --format avif 需 Pillow >= 11.3（或另装 pillow-avif-plugin）
 
-import os, sys, io, shutil, argparse
+
+import os, sys, io, gc, math, shutil, struct, ctypes, ctypes.util, hashlib, argparse, threading, subprocess
 from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from functools import lru_cache, partial
 from PIL import Image, ImageOps
 
 # 可选支持 HEIC/HEIF
@@ -17,19 +27,91 @@ try:
 except Exception:
     pass
 
+# 可选支持 AVIF 输出（Pillow 11.3 起自带；更早的版本用 pillow-avif-plugin）
+try:
+    import pillow_avif  # type: ignore
+except Exception:
+    pass
+
+# 可选：numpy（--cache-dir）与 OpenCV JPEG 编码器（--encoder cv2）
+try:
+    import numpy as np
+except Exception:
+    np = None
+try:
+    import cv2  # type: ignore
+except Exception:
+    cv2 = None
+
 IMAGE_EXTS = {".jpg", ".jpeg", ".png", ".tif", ".tiff", ".bmp", ".webp", ".heic", ".heif"}
+BATCH_SIZE = 64   # 每个进程池任务处理的文件数
 
 def is_image_file(p: Path) -> bool:
     return p.suffix.lower() in IMAGE_EXTS
 
+def has_alpha(img: Image.Image) -> bool:
+    return (img.mode in ("RGBA", "LA")) or (img.mode == "P" and "transparency" in img.info)
+
+def avif_supported() -> bool:
+    Image.init()
+    return "AVIF" in Image.SAVE
+
 def ensure_dir(p: Path):
     p.parent.mkdir(parents=True, exist_ok=True)
 
+def find_exif_orientation(raw: bytes) -> tuple[int, int | None, str] | None:
+    """
+    直接在原始 EXIF 字节里找 IFD0 的 Orientation(274)，不构造 Pillow 的 Exif 映射。
+    返回 (方向, 取值在 raw 中的偏移或None, struct字节序)；没有该标签时方向为 1、偏移为 None；无法解析返回 None。
+    """
+    start = 6 if raw.startswith(b"Exif\x00\x00") else 0
+    endian = {b"II": "<", b"MM": ">"}.get(raw[start:start + 2])
+    if endian is None:
+        return None
+    try:
+        magic, ifd = struct.unpack_from(endian + "HI", raw, start + 2)
+        if magic != 42:
+            return None
+        ifd += start
+        (count,) = struct.unpack_from(endian + "H", raw, ifd)
+        for i in range(count):
+            entry = ifd + 2 + 12 * i
+            tag, typ = struct.unpack_from(endian + "HH", raw, entry)
+            if tag == 0x0112:
+                if typ != 3:   # 应为 SHORT
+                    return None
+                return struct.unpack_from(endian + "H", raw, entry + 8)[0], entry + 8, endian
+    except struct.error:
+        return None
+    return 1, None, endian
+
+def auto_need_rotate(img: Image.Image, ori: int) -> bool:
+    w, h = img.size
+    if ori in (3, 4):         # 180°
+        return True
+    if ori in (5, 6, 7, 8):   # 90°/270°
+        return w >= h         # 横图才旋转；已是竖图则不旋
+    return False
+
 def normalize_orientation(img: Image.Image, strategy: str = "auto") -> tuple[Image.Image, bytes | None]:
     """
     返回 (像素已标准化的图像, EXIF字节或None)。写回的EXIF已将 Orientation(274)=1。
     strategy: "auto" | "force" | "strip"
     """
+    if strategy == "auto":
+        # 快速路径：直接读写原始 EXIF 里的 Orientation，解析失败再走 getexif()
+        raw = img.info.get("exif")
+        found = find_exif_orientation(raw) if raw else None
+        if found is not None:
+            ori, pos, endian = found
+            if ori == 1 and raw.startswith(b"Exif\x00\x00"):
+                return img, raw   # 已是正向：原样返回，不复制也不改写
+            base = ImageOps.exif_transpose(img) if auto_need_rotate(img, ori) else img
+            out = bytearray(raw if raw.startswith(b"Exif\x00\x00") else b"Exif\x00\x00" + raw)
+            if pos is not None:
+                struct.pack_into(endian + "H", out, pos + len(out) - len(raw), 1)
+            return base, bytes(out)
+
     try:
         exif = img.getexif()
     except Exception:
@@ -53,154 +135,707 @@ def normalize_orientation(img: Image.Image, strategy: str = "auto") -> tuple[Ima
         return base, None
 
     # strategy == "auto"
-    w, h = img.size
-    need_rotate = False
-    if ori in (3, 4):         # 180°
-        need_rotate = True
-    elif ori in (5, 6, 7, 8): # 90°/270°
-        need_rotate = (w >= h)  # 横图才旋转；已是竖图则不旋
-
-    base = ImageOps.exif_transpose(img) if need_rotate else img
+    base = ImageOps.exif_transpose(img) if auto_need_rotate(img, ori) else img
     if exif:
         exif[274] = 1
         return base, exif.tobytes()
     return base, None
 
+def encode_image(img: Image.Image, **save_kwargs) -> bytes:
+    buf = io.BytesIO()
+    img.save(buf, **save_kwargs)
+    return buf.getvalue()
+
+def bisect_quality(probe, limit_bytes: int, lo: int, hi: int, best: int | None = None, tol: int = 3) -> int | None:
+    """
+    在 [lo, hi] 上二分查找能放进 limit_bytes 的最高质量（体积随质量单调），区间窄于 tol 时停止；tol=0 时找到确切值。
+    probe(q) 返回该质量的体积。best 为已知能放下的质量。返回质量；最低质量也放不下时返回 None。
+    """
+    q_lo = lo
+    while hi - lo >= tol:
+        mid = (lo + hi) // 2
+        if probe(mid) <= limit_bytes:
+            best = mid
+            lo = mid + 1   # 放得下，试更高质量
+        else:
+            hi = mid - 1
+    if best is not None:
+        return best
+
+    # 一次都没放下：区间收窄到底部，用最低质量再确认一次
+    return q_lo if probe(q_lo) <= limit_bytes else None
+
+@lru_cache(maxsize=None)
+def thread_pool(threads: int) -> ThreadPoolExecutor:
+    """每个进程复用一个线程池。"""
+    return ThreadPoolExecutor(max_workers=threads)
+
+def search_quality(encode, limit_bytes: int, q_lo: int, q_hi: int,
+                   k: tuple[float, float], q_cal: int = 80, threads: int = 1,
+                   probe_top: bool = False) -> tuple[int | None, bytes]:
+    """
+    先在 q_cal 编码一次，用 size(q) ≈ size(q_cal)·exp(k·(q-q_cal)) 预测体积为 95% limit 的质量并验证；
+    k = (q_cal 以下的斜率, q_cal 以上的斜率)，体积在高质量段涨得快得多。放不下就降 5 再试（最多两次），模型仍不准时退回二分。
+    放得下之后往上收紧：上方已有放不下的实测点就在两者之间二分；没有且不到 95% limit 时用最近的两个实测点重估斜率再往上预测。
+    返回 (质量, 数据)；最低质量也放不下时返回 (None, 最低质量的数据)。
+    各次编码只记体积，数据只留放得下的最高质量和最低质量两份，不随试探次数累积。
+    probe_top=True 时先试 q_hi：略超 limit 的常见情况一次编码就返回；放不下则用它和 q_cal 两点实测 q_cal 以上的斜率。
+    threads > 1 时预测质量及两次下调的候选用线程并发编码（Pillow 编码时释放 GIL）。
+    """
+    sizes = {}
+    kept = {}   # "best": (放得下的最高质量, 数据)，"floor": q_lo 的数据
+    def keep(q: int, data: bytes):
+        sizes[q] = len(data)
+        if len(data) <= limit_bytes and q > kept.get("best", (-1,))[0]:
+            kept["best"] = (q, data)
+        if q == q_lo:
+            kept["floor"] = data
+    def probe(q: int) -> int:
+        if q not in sizes:
+            keep(q, encode(q))
+        return sizes[q]
+    def result(q: int | None) -> tuple[int | None, bytes]:
+        return kept["best"] if q is not None else (None, kept["floor"])
+
+    top = None
+    if probe_top:
+        top = probe(q_hi)
+        if top <= limit_bytes:
+            return result(q_hi)
+
+    q_cal = min(max(q_cal, q_lo), q_hi)
+    cal = probe(q_cal)
+    best = q_cal if cal <= limit_bytes else None
+
+    k_below, k_above = k
+    if top is not None and q_hi > q_cal and top > cal:
+        k_above = math.log(top / cal) / (q_hi - q_cal)
+    r = math.log(limit_bytes * 0.95 / cal)
+    q = q_cal + math.floor(r / (k_above if r > 0 else k_below))
+    q = min(max(q, q_lo), q_hi - 1 if top is not None else q_hi)
+
+    def refine(q: int) -> int:
+        size = sizes[q]
+        fail = min((c for c in sizes if c > q and sizes[c] > limit_bytes), default=None)
+        if fail is not None:
+            if fail - q <= 1 or size >= 0.95 * limit_bytes:
+                return q
+            return bisect_quality(probe, limit_bytes, q + 1, fail - 1, q, tol=0)
+        if q >= q_hi or size >= 0.95 * limit_bytes:
+            return q
+        near = min((c for c in sizes if c != q), key=lambda c: abs(c - q), default=None)
+        if near is not None and (sizes[near] - size) * (near - q) > 0:
+            slope = math.log(sizes[near] / size) / (near - q)   # 相邻质量体积有噪声，斜率可能偏小，超了会走上面的二分
+        else:
+            slope = k_above if q >= q_cal else k_below
+        q2 = min(q + max(1, math.floor(math.log(limit_bytes * 0.95 / size) / slope)), q_hi)
+        probe(q2)
+        return refine(max(q, q2) if sizes[q2] <= limit_bytes else q)
+
+    if threads > 1:
+        todo = [c for c in dict.fromkeys(max(q_lo, q - 5 * i) for i in range(3))
+                if c not in sizes and (best is None or c > best)]
+        for c, data in zip(todo, thread_pool(threads).map(encode, todo)):
+            keep(c, data)
+    for _ in range(3):   # 预测一次 + 最多两次下调
+        if best is not None and q <= best:
+            return result(refine(best))
+        size = probe(q)
+        if size <= limit_bytes:
+            return result(refine(q))
+        if q == q_lo:
+            return result(None)
+        q = max(q_lo, q - 5)
+
+    return result(bisect_quality(probe, limit_bytes, best + 1 if best else q_lo, q, best))
+
+def thread_safe_probe(encode, img: Image.Image):
+    """
+    Image.save 会把参数写进 img.encoderinfo，多个线程同时保存同一个 Image 对象会串参数；
+    线程池里的线程各用一份拷贝编码（每个尺度每线程只拷贝一次）。调用线程在线程池工作时阻塞在 map 上，直接用 img。
+    """
+    owner = threading.get_ident()
+    local = threading.local()
+    def probe(q: int) -> bytes:
+        if threading.get_ident() == owner:
+            return encode(img, q)
+        if getattr(local, "img", None) is None:
+            local.img = img.copy()
+        return encode(local.img, q)
+    return probe
+
+def fit_under_limit(base: Image.Image,
+                    encode,
+                    limit_bytes: int,
+                    min_side: int,
+                    quality_range: tuple[int, int],
+                    k: tuple[float, float],
+                    cache: Path | None = None,
+                    threads: int = 1,
+                    thread_safe: bool = False,
+                    full_size: tuple[int, int] | None = None) -> bytes:
+    """
+    encode(img, quality) -> 编码数据；base 须已是最终编码模式。thread_safe=True 表示 encode 不改动 img，多线程时共用同一幅图。在每个尺度上查找质量，放不下就按 0.85 等比缩小，直到 <= limit_bytes 或短边到 min_side。
+    缩小后仍在完整质量区间内搜索，校准质量由上一尺度最低质量的体积按像素数外推。
+    按像素数估算仍超过 2 倍 limit 的尺度先跳过不编码；这个估算偏保守，找到结果后再按实测体积逐档退回被跳过的尺度。
+    cache 为缓存目录：缩放结果按需从缓存读，新算出的尺度写回；原尺寸的 base 本身不存。
+    full_size 为原图尺寸：base 是解码时缩小得到的，仍按原图尺寸的 0.85 档位缩放，比 base 大的档位直接略过，输出尺寸与不缩小解码时一致。
+    """
+    q_lo, q_hi = quality_range
+    w, h = full_size or base.size
+    scale = 1.0
+    work = base
+    est = None         # (上一尺度最低质量的字节数, 像素数)
+    skipped = []       # 自上一次编码以来跳过的尺度（从大到小）
+
+    def level(size, src):
+        out = load_level(cache, base, size) if cache is not None else None
+        if out is None:
+            # 从已有的较大结果缩，而不是每次都从原图重采样；跳过多个尺度时 reducing_gap 先做廉价的整数倍缩小
+            out = src.resize(size, Image.LANCZOS, reducing_gap=3.0)
+            if cache is not None:
+                save_level(cache, base, size, out)
+        return out
+
+    def search(work, q_cal):
+        assert work.mode == base.mode   # 编码时不应再发生模式转换
+        if threads > 1 and not thread_safe:
+            probe = thread_safe_probe(encode, work)
+        else:
+            probe = lambda q, work=work: encode(work, q)
+        if q_cal is None:
+            return search_quality(probe, limit_bytes, q_lo, q_hi, k=k, threads=threads, probe_top=True)
+        return search_quality(probe, limit_bytes, q_lo, q_hi, k=k, q_cal=q_cal, threads=threads)
+
+    def predict(size):
+        """按像素数线性外推最低质量的体积，返回该尺度体积约为 95% limit 的质量。"""
+        guess = est[0] * size[0] * size[1] / est[1]
+        return min(max(q_lo + math.floor(math.log(limit_bytes * 0.95 / guess) / k[0]), q_lo), q_hi)
+
+    while True:
+        size = (max(1,int(w*scale)), max(1,int(h*scale)))
+        if size[0] > base.width or size[1] > base.height:
+            scale *= 0.85
+            continue
+        last = min(size) <= min_side
+        if est is not None and not last and est[0] * size[0] * size[1] / est[1] > 2 * limit_bytes:
+            skipped.append(size)
+            scale *= 0.85
+            continue
+
+        bigger = work
+        if work.size != size:
+            work = level(size, work)
+        q, data = search(work, None if est is None else predict(size))
+
+        if q is not None:
+            # 跳过的尺度可能其实放得下：由当前结果推算上一档最低质量的体积，放得下就逐档退回
+            while skipped:
+                up_size = skipped[-1]
+                guess = len(data) * math.exp(-k[0] * (q - q_lo)) * up_size[0] * up_size[1] / (work.size[0] * work.size[1])
+                if guess > limit_bytes:
+                    break
+                up = level(skipped.pop(), bigger)
+                q_up, data_up = search(up, q_lo)
+                if q_up is None:
+                    break
+                work, q, data = up, q_up, data_up
+            return data
+
+        if last:
+            return data
+        est = (len(data), size[0] * size[1])
+        skipped = []
+        scale *= 0.85
+
+def insert_jpeg_metadata(data: bytes, exif_bytes: bytes | None, icc: bytes | None) -> bytes:
+    """把 EXIF(APP1) 和 ICC(APP2，按 ICC_PROFILE 规范分段) 插到 SOI/JFIF 之后。超出段长上限的 EXIF 直接丢弃。"""
+    segments = []
+    if exif_bytes and len(exif_bytes) <= 65533:
+        segments.append(b"\xff\xe1" + struct.pack(">H", len(exif_bytes) + 2) + exif_bytes)
+    if icc:
+        chunks = [icc[i:i + 65519] for i in range(0, len(icc), 65519)]
+        for i, chunk in enumerate(chunks, 1):
+            payload = b"ICC_PROFILE\x00" + bytes((i, len(chunks))) + chunk
+            segments.append(b"\xff\xe2" + struct.pack(">H", len(payload) + 2) + payload)
+    if not segments:
+        return data
+
+    pos = 2                                   # SOI
+    if data[2:4] == b"\xff\xe0":              # JFIF APP0
+        pos += 2 + struct.unpack_from(">H", data, 4)[0]
+    return data[:pos] + b"".join(segments) + data[pos:]
+
+def cv2_jpeg_encoder(exif_bytes: bytes | None, icc: bytes | None, fast: bool = False):
+    """返回用 cv2.imencode 编码 JPEG 的 encode(img, quality)；同一尺度的多次编码复用转换好的 BGR 数组。"""
+    if cv2 is None or np is None:
+        raise RuntimeError("--encoder cv2 requires opencv-python")
+    cache = [None, None]   # [img, BGR 数组]
+
+    def encode(img: Image.Image, q: int) -> bytes:
+        if cache[0] is not img:
+            arr = np.asarray(img)
+            cache[:] = [img, arr[:, :, ::-1] if arr.ndim == 3 else arr]   # RGB -> BGR
+        params = [cv2.IMWRITE_JPEG_QUALITY, q,
+                  cv2.IMWRITE_JPEG_OPTIMIZE, 0 if fast else 1,
+                  cv2.IMWRITE_JPEG_PROGRESSIVE, 0 if fast else 1]
+        ok, buf = cv2.imencode(".jpg", cache[1], params)
+        if not ok:
+            raise RuntimeError("cv2.imencode failed")
+        if exif_bytes or icc:
+            return insert_jpeg_metadata(buf.tobytes(), exif_bytes, icc)
+        return buf.tobytes()
+
+    return encode
+
 def save_jpeg_under_limit(img: Image.Image,
                           limit_bytes: int,
                           exif_bytes: bytes | None,
                           icc: bytes | None,
                           min_side: int = 800,
-                          quality_steps = (92, 85, 80, 72, 65, 60, 50)) -> bytes:
-    """逐步降质，必要时等比缩放，直到 <= limit_bytes。此时 img 已完成方向归一化。"""
+                          quality_range: tuple[int, int] = (50, 92),
+                          fast: bool = False,
+                          encoder: str = "pil",
+                          cache: Path | None = None,
+                          threads: int = 1,
+                          full_size: tuple[int, int] | None = None) -> bytes:
+    """
+    查找质量，必要时等比缩放，直到 <= limit_bytes。此时 img 已完成方向归一化。
+    fast=True 时关闭 optimize/progressive（progressive 在 libjpeg-turbo 下总会做 Huffman 优化），
+    每次编码约快一倍，体积大 5~13%。encoder="cv2" 时改用 OpenCV 编码。
+    """
     base = img
     if base.mode not in ("RGB", "L"):
         base = base.convert("RGB")
+    base.load()   # 一次性解码/转换好像素，之后的缩放与各质量编码都复用
 
-    w, h = base.size
-    scale = 1.0
-    last_data = None
+    if encoder == "cv2":
+        encode = cv2_jpeg_encoder(exif_bytes, icc, fast=fast)
+    else:
+        save_kwargs = dict(format="JPEG", optimize=not fast, progressive=not fast, subsampling="4:2:0")
+        if exif_bytes: save_kwargs["exif"] = exif_bytes
+        if icc:        save_kwargs["icc_profile"] = icc
+        encode = lambda im, q: encode_image(im, quality=q, **save_kwargs)
 
-    while True:
-        work = base if scale == 1.0 else base.resize((max(1,int(w*scale)), max(1,int(h*scale))), Image.LANCZOS)
-
-        for q in quality_steps:
-            buf = io.BytesIO()
-            save_kwargs = dict(format="JPEG", quality=q, optimize=True, progressive=True, subsampling="4:2:0")
-            if exif_bytes: save_kwargs["exif"] = exif_bytes
-            if icc:        save_kwargs["icc_profile"] = icc
-            work.save(buf, **save_kwargs)
-            data = buf.getvalue()
-            last_data = data
-            if len(data) <= limit_bytes:
-                return data
-
-        if min(work.size) <= min_side:
-            return last_data
-        scale *= 0.85
+    return fit_under_limit(base, encode, limit_bytes, min_side, quality_range, k=(0.021, 0.047), cache=cache, threads=threads,
+                           thread_safe=encoder == "cv2", full_size=full_size)   # cv2 只读像素
 
 def save_webp_under_limit(img: Image.Image,
                           limit_bytes: int,
                           exif_bytes: bytes | None,
                           icc: bytes | None,
                           min_side: int = 800,
-                          quality_steps = (95, 90, 85, 80, 75, 70, 65, 60)) -> bytes:
-    """保存为 WebP（可带透明），逐步降质与缩放至 <= limit_bytes。此时 img 已完成方向归一化。"""
+                          quality_range: tuple[int, int] = (60, 95),
+                          cache: Path | None = None,
+                          threads: int = 1,
+                          full_size: tuple[int, int] | None = None) -> bytes:
+    """保存为 WebP（可带透明），查找质量并缩放至 <= limit_bytes。此时 img 已完成方向归一化。"""
     base = img
-    has_alpha = (base.mode in ("RGBA", "LA")) or (base.mode == "P" and "transparency" in base.info)
-    if has_alpha:
+    if has_alpha(base):
         if base.mode != "RGBA":
             base = base.convert("RGBA")
     else:
         if base.mode not in ("RGB", "L"):
             base = base.convert("RGB")
+    base.load()
 
-    w, h = base.size
-    scale = 1.0
-    last_data = None
+    save_kwargs = dict(format="WEBP", method=6)
+    if exif_bytes: save_kwargs["exif"] = exif_bytes  # 某些查看器可能忽略 WebP EXIF，但我们仍写入
+    if icc:        save_kwargs["icc_profile"] = icc
 
-    while True:
-        work = base if scale == 1.0 else base.resize((max(1,int(w*scale)), max(1,int(h*scale))), Image.LANCZOS)
-
-        for q in quality_steps:
-            buf = io.BytesIO()
-            save_kwargs = dict(format="WEBP", quality=q, method=6)
-            if exif_bytes: save_kwargs["exif"] = exif_bytes  # 某些查看器可能忽略 WebP EXIF，但我们仍写入
-            if icc:        save_kwargs["icc_profile"] = icc
-            work.save(buf, **save_kwargs)
-            data = buf.getvalue()
-            last_data = data
-            if len(data) <= limit_bytes:
-                return data
-
-        if min(work.size) <= min_side:
-            return last_data
-        scale *= 0.85
+    return fit_under_limit(base, lambda im, q: encode_image(im, quality=q, **save_kwargs),
+                           limit_bytes, min_side, quality_range, k=(0.021, 0.077), cache=cache, threads=threads,
+                           full_size=full_size)
 
-def compress_one(input_path: Path, output_path: Path, limit_bytes: int, min_side: int = 800, orient_strategy: str = "auto") -> tuple[bool, str]:
+def save_avif_under_limit(img: Image.Image,
+                          limit_bytes: int,
+                          exif_bytes: bytes | None,
+                          icc: bytes | None,
+                          min_side: int = 800,
+                          quality_range: tuple[int, int] = (50, 90),
+                          cache: Path | None = None,
+                          threads: int = 1,
+                          full_size: tuple[int, int] | None = None) -> bytes:
+    """保存为 AVIF（可带透明），查找质量并缩放至 <= limit_bytes。此时 img 已完成方向归一化。"""
+    base = img
+    if has_alpha(base):
+        if base.mode != "RGBA":
+            base = base.convert("RGBA")
+    elif base.mode != "RGB":
+        base = base.convert("RGB")   # AVIF 编码器只收 RGB/RGBA
+    base.load()
+
+    save_kwargs = dict(format="AVIF", speed=6)
+    if exif_bytes: save_kwargs["exif"] = exif_bytes
+    if icc:        save_kwargs["icc_profile"] = icc
+
+    return fit_under_limit(base, lambda im, q: encode_image(im, quality=q, **save_kwargs),
+                           limit_bytes, min_side, quality_range, k=(0.032, 0.045), cache=cache, threads=threads,
+                           full_size=full_size)
+
+# IJG 标准亮度量化表（质量 50），用于从源 JPEG 的量化表反推其质量
+STD_LUMA_QTABLE = (16, 11, 10, 16, 24, 40, 51, 61, 12, 12, 14, 19, 26, 58, 60, 55,
+                   14, 13, 16, 24, 40, 57, 69, 56, 14, 17, 22, 29, 51, 87, 80, 62,
+                   18, 22, 37, 56, 68, 109, 103, 77, 24, 35, 55, 64, 81, 104, 113, 92,
+                   49, 64, 78, 87, 103, 121, 120, 101, 72, 92, 95, 98, 112, 100, 103, 99)
+
+def jpeg_quality(im: Image.Image) -> int | None:
+    """由亮度量化表估计源 JPEG 的编码质量（IJG 缩放公式的反算）；非 JPEG 或没有量化表返回 None。"""
+    table = getattr(im, "quantization", None) or {}
+    if 0 not in table:
+        return None
+    scale = sum(table[0]) * 100 / sum(STD_LUMA_QTABLE)
+    q = 5000 / scale if scale > 100 else (200 - scale) / 2
+    return min(max(round(q), 1), 100)
+
+def decode_size_for_limit(size: tuple[int, int], src_size: int, limit_bytes: int, min_side: int,
+                          src_quality: int | None = None, q_lo: int = 50, k: float = 0.04) -> tuple[int, int] | None:
+    """
+    预计输出尺寸，用于解码时直接缩小（JPEG 的 draft()、WebP 的 libwebp 缩放解码）。
+    全尺寸最低质量的体积按 src_size·exp(-k·(src_quality-q_lo)) 估计（不知道源质量时按 1/4），边长比约为 sqrt(limit/该体积)；
+    体积随像素数增长慢于线性，再放宽 1.25 倍，短边不小于 min_side，然后向上取到 1/2、1/4、1/8，
+    所以返回的尺寸不小于预计尺寸，与 draft() 的取法一致；用不到 1/2 时返回 None。
+    """
+    w, h = size
+    floor_size = src_size * (min(1.0, math.exp(-k * (src_quality - q_lo))) if src_quality else 0.25)
+    ratio = 1.25 * math.sqrt(limit_bytes / floor_size)
+    ratio = max(ratio, min_side / max(1, min(w, h)))
+    if ratio > 0.5:
+        return None
+    reduce = 2
+    while reduce < 8 and ratio <= 0.5 / reduce:
+        reduce *= 2
+    return max(1, -(-w // reduce)), max(1, -(-h // reduce))
+
+# libwebp 解码接口（decode.h，WEBP_DECODER_ABI_VERSION 0x0209），只声明用到的字段
+WEBP_DECODER_ABI_VERSION = 0x0209
+
+class WebPBitstreamFeatures(ctypes.Structure):
+    _fields_ = [("width", ctypes.c_int), ("height", ctypes.c_int), ("has_alpha", ctypes.c_int),
+                ("has_animation", ctypes.c_int), ("format", ctypes.c_int), ("pad", ctypes.c_uint32 * 5)]
+
+class WebPRGBABuffer(ctypes.Structure):
+    _fields_ = [("rgba", ctypes.POINTER(ctypes.c_uint8)), ("stride", ctypes.c_int), ("size", ctypes.c_size_t)]
+
+class WebPYUVABuffer(ctypes.Structure):
+    _fields_ = [("y", ctypes.c_void_p), ("u", ctypes.c_void_p), ("v", ctypes.c_void_p), ("a", ctypes.c_void_p),
+                ("y_stride", ctypes.c_int), ("u_stride", ctypes.c_int), ("v_stride", ctypes.c_int),
+                ("a_stride", ctypes.c_int), ("y_size", ctypes.c_size_t), ("u_size", ctypes.c_size_t),
+                ("v_size", ctypes.c_size_t), ("a_size", ctypes.c_size_t)]
+
+class WebPDecBuffer(ctypes.Structure):
+    class U(ctypes.Union):
+        _fields_ = [("RGBA", WebPRGBABuffer), ("YUVA", WebPYUVABuffer)]
+    _fields_ = [("colorspace", ctypes.c_int), ("width", ctypes.c_int), ("height", ctypes.c_int),
+                ("is_external_memory", ctypes.c_int), ("u", U), ("pad", ctypes.c_uint32 * 4),
+                ("private_memory", ctypes.c_void_p)]
+
+class WebPDecoderOptions(ctypes.Structure):
+    _fields_ = [("bypass_filtering", ctypes.c_int), ("no_fancy_upsampling", ctypes.c_int),
+                ("use_cropping", ctypes.c_int), ("crop_left", ctypes.c_int), ("crop_top", ctypes.c_int),
+                ("crop_width", ctypes.c_int), ("crop_height", ctypes.c_int),
+                ("use_scaling", ctypes.c_int), ("scaled_width", ctypes.c_int), ("scaled_height", ctypes.c_int),
+                ("use_threads", ctypes.c_int), ("dithering_strength", ctypes.c_int), ("flip", ctypes.c_int),
+                ("alpha_dithering_strength", ctypes.c_int), ("pad", ctypes.c_uint32 * 5)]
+
+class WebPDecoderConfig(ctypes.Structure):
+    _fields_ = [("input", WebPBitstreamFeatures), ("output", WebPDecBuffer), ("options", WebPDecoderOptions)]
+
+@lru_cache(maxsize=None)
+def load_libwebp():
+    """每个进程加载一次系统 libwebp；找不到返回 None。"""
+    name = ctypes.util.find_library("webp")
+    if not name:
+        return None
     try:
-        if input_path.stat().st_size <= limit_bytes:
+        lib = ctypes.CDLL(name)
+        lib.WebPInitDecoderConfigInternal.argtypes = [ctypes.POINTER(WebPDecoderConfig), ctypes.c_int]
+        lib.WebPGetFeaturesInternal.argtypes = [ctypes.c_char_p, ctypes.c_size_t,
+                                                ctypes.POINTER(WebPBitstreamFeatures), ctypes.c_int]
+        lib.WebPDecode.argtypes = [ctypes.c_char_p, ctypes.c_size_t, ctypes.POINTER(WebPDecoderConfig)]
+    except (OSError, AttributeError):
+        return None
+    return lib
+
+def decode_webp_scaled(input_path: Path, size: tuple[int, int]) -> Image.Image | None:
+    """
+    用 libwebp 的 use_scaling 在解码时直接缩放到 size，省掉全尺寸解码的内存和时间。
+    返回的图像不带 info（EXIF/ICC 由调用方补上）；没有 libwebp、动图或解码失败返回 None，由调用方回退到 PIL。
+    """
+    lib = load_libwebp()
+    if lib is None:
+        return None
+    data = input_path.read_bytes()
+    config = WebPDecoderConfig()
+    if not lib.WebPInitDecoderConfigInternal(ctypes.byref(config), WEBP_DECODER_ABI_VERSION):
+        return None
+    if lib.WebPGetFeaturesInternal(data, len(data), ctypes.byref(config.input), WEBP_DECODER_ABI_VERSION) != 0:
+        return None
+    if config.input.has_animation:
+        return None
+
+    mode, channels = ("RGBA", 4) if config.input.has_alpha else ("RGB", 3)
+    w, h = size
+    config.options.use_scaling = 1
+    config.options.scaled_width, config.options.scaled_height = w, h
+    # 直接解码进我们分配的缓冲区（MODE_RGB=0 / MODE_RGBA=1）
+    buf = bytearray(w * h * channels)
+    config.output.colorspace = 1 if channels == 4 else 0
+    config.output.is_external_memory = 1
+    config.output.u.RGBA.rgba = (ctypes.c_uint8 * len(buf)).from_buffer(buf)
+    config.output.u.RGBA.stride = w * channels
+    config.output.u.RGBA.size = len(buf)
+    if lib.WebPDecode(data, len(data), ctypes.byref(config)) != 0:
+        return None
+    return Image.frombuffer(mode, (w, h), buf, "raw", mode, 0, 1)
+
+def jpegtran_repack(input_path: Path, output_path: Path, limit_bytes: int) -> bool:
+    """
+    用 jpegtran（libjpeg-turbo 或 mozjpeg）无损重做熵编码（optimize + progressive），不经过 DCT/IDCT。
+    结果 <= limit_bytes 时写入 output_path 并返回 True；没有 jpegtran 或放不下返回 False。
+    """
+    exe = shutil.which("jpegtran")
+    if not exe:
+        return False
+    r = subprocess.run([exe, "-copy", "all", "-optimize", "-progressive", str(input_path)],
+                       capture_output=True)
+    if r.returncode != 0 or not r.stdout or len(r.stdout) > limit_bytes:
+        return False
+    ensure_dir(output_path)
+    with open(output_path, "wb") as f:
+        f.write(r.stdout)
+    return True
+
+def cache_path(cache_dir: Path, input_path: Path, orient_strategy: str) -> Path:
+    """每个 (源路径, 方向策略) 一个缓存目录；缩放结果与输出格式无关，WebP/AVIF/JPEG 共用。"""
+    key = hashlib.sha1(f"{input_path}|{orient_strategy}".encode("utf-8")).hexdigest()
+    return cache_dir / key
+
+def open_cache(path: Path, st: os.stat_result) -> Path:
+    """
+    源文件的 mtime 记在条目里的 mtime 文件中；对不上（源文件改动过）就清空整个条目，不留旧结果。
+    命中时刷新 mtime 文件的修改时间，供 prune_cache 按 LRU 淘汰。
+    """
+    stamp = path / "mtime"
+    try:
+        fresh = stamp.read_text() == str(st.st_mtime_ns)
+    except OSError:
+        fresh = False
+    if fresh:
+        os.utime(stamp)
+    else:
+        shutil.rmtree(path, ignore_errors=True)
+        path.mkdir(parents=True, exist_ok=True)
+        stamp.write_text(str(st.st_mtime_ns))
+    return path
+
+def level_name(base: Image.Image, size: tuple[int, int]) -> str:
+    # 带上起点图的尺寸和模式：缩小解码、模式转换不同的结果不会混用
+    return f"{base.width}x{base.height}-{size[0]}x{size[1]}-{base.mode}.npy"
+
+def load_level(path: Path, base: Image.Image, size: tuple[int, int]) -> Image.Image | None:
+    """按需读取一个尺度（mmap，只读这一个文件）；没有或损坏返回 None。"""
+    try:
+        img = Image.fromarray(np.load(path / level_name(base, size), mmap_mode="r"))
+    except Exception:
+        return None
+    return img if img.mode == base.mode and img.size == size else None
+
+def save_level(path: Path, base: Image.Image, size: tuple[int, int], img: Image.Image):
+    """先写临时文件再改名，避免并发 worker 读到半个文件。"""
+    name = level_name(base, size)
+    tmp = path / f"{name}.{os.getpid()}.tmp"
+    with open(tmp, "wb") as f:
+        np.save(f, np.asarray(img))
+    os.replace(tmp, path / name)
+
+def prune_cache(cache_dir: Path, max_bytes: int):
+    """按最近使用时间（mtime 文件的修改时间）从旧到新删除缓存条目，直到总大小 <= max_bytes。"""
+    if not cache_dir.is_dir():
+        return
+    entries = []
+    total = 0
+    for entry in os.scandir(cache_dir):
+        if not entry.is_dir():
+            continue
+        size = used = 0   # 没有 mtime 文件的残缺条目最先删
+        for f in os.scandir(entry.path):
+            fst = f.stat()
+            size += fst.st_size
+            if f.name == "mtime":
+                used = fst.st_mtime
+        entries.append((used, size, entry.path))
+        total += size
+    for used, size, p in sorted(entries):
+        if total <= max_bytes:
+            break
+        shutil.rmtree(p, ignore_errors=True)
+        total -= size
+
+def compress_one(input_path: Path, output_path: Path, limit_bytes: int, min_side: int = 800, orient_strategy: str = "auto",
+                 fast: bool = False, encoder: str = "pil", cache_dir: Path | None = None,
+                 threads: int = 1, fmt: str = "webp") -> tuple[bool, str]:
+    try:
+        st = input_path.stat()
+        src_size = st.st_size
+        if src_size <= limit_bytes:
             ensure_dir(output_path)
             shutil.copy2(input_path, output_path)
             return True, f"SKIP (<= limit): {input_path}"
 
-        with Image.open(input_path) as im:
+        im = Image.open(input_path)
+        base = None
+        try:
+            # 略超 limit 且无需转向的 JPEG：先试无损重打包，不解码
+            if im.format == "JPEG" and src_size <= limit_bytes * 1.2 and im.getexif().get(274, 1) == 1:
+                out = output_path.with_suffix(".jpg")
+                if jpegtran_repack(input_path, out, limit_bytes):
+                    return True, f"JPEG->jpegtran->OK: {input_path} -> {out.name}"
+
+            cache = open_cache(cache_path(cache_dir, input_path, orient_strategy), st) if cache_dir else None
+            # 需要大幅缩小时在解码阶段就缩小
+            target = decode_size_for_limit(im.size, src_size, limit_bytes, min_side, src_quality=jpeg_quality(im))
+            full_size = im.size
+            decoded = None
+            if target and im.format == "JPEG":
+                im.draft("RGB", target)
+            elif target and im.format == "WEBP" and not getattr(im, "is_animated", False):
+                decoded = decode_webp_scaled(input_path, target)
+            if decoded is not None:
+                decoded.info = dict(im.info)   # 保留 EXIF/ICC
+                im.close()
+                im = decoded
             base, exif_bytes = normalize_orientation(im, strategy=orient_strategy)
+            if base.size != im.size:   # 转了 90°
+                full_size = full_size[::-1]
             icc  = im.info.get("icc_profile", None)
-            ext = input_path.suffix.lower()
-
-            if ext == ".png":
-                data = save_webp_under_limit(base, limit_bytes, exif_bytes, icc, min_side=min_side)
-                out = output_path.with_suffix(".webp")
-                ensure_dir(out)
-                with open(out, "wb") as f:
-                    f.write(data)
-                return True, f"PNG->WebP->OK: {input_path} -> {out.name}"
-
-            elif ext in (".jpg", ".jpeg", ".webp", ".tif", ".tiff", ".bmp", ".heic", ".heif"):
-                data = save_jpeg_under_limit(base, limit_bytes, exif_bytes, icc, min_side=min_side)
-                out = output_path.with_suffix(".jpg")
-                ensure_dir(out)
-                with open(out, "wb") as f:
-                    f.write(data)
-                return True, f"{ext.upper().lstrip('.')}->JPEG->OK: {input_path} -> {out.name}"
-
-            else:
-                data = save_jpeg_under_limit(base, limit_bytes, exif_bytes, icc, min_side=min_side)
-                out = output_path.with_suffix(".jpg")
-                ensure_dir(out)
-                with open(out, "wb") as f:
-                    f.write(data)
-                return True, f"OTHER->JPEG->OK: {input_path} -> {out.name}"
+            base.load()
+        finally:
+            # 编码前释放原图：base 是转正后的新图时原图像素已无用；base 就是 im 时 load() 已关闭文件
+            if base is not im:
+                im.close()
+        del im
+
+        ext = input_path.suffix.lower()
+
+        if fmt == "avif" and (ext == ".png" or has_alpha(base)):
+            data = save_avif_under_limit(base, limit_bytes, exif_bytes, icc, min_side=min_side, cache=cache,
+                                         threads=threads, full_size=full_size)
+            out = output_path.with_suffix(".avif")
+            msg = f"{ext.upper().lstrip('.')}->AVIF->OK: {input_path} -> {out.name}"
+
+        elif ext == ".png":
+            data = save_webp_under_limit(base, limit_bytes, exif_bytes, icc, min_side=min_side, cache=cache,
+                                         threads=threads, full_size=full_size)
+            out = output_path.with_suffix(".webp")
+            msg = f"PNG->WebP->OK: {input_path} -> {out.name}"
+
+        elif ext in (".jpg", ".jpeg", ".webp", ".tif", ".tiff", ".bmp", ".heic", ".heif"):
+            data = save_jpeg_under_limit(base, limit_bytes, exif_bytes, icc, min_side=min_side, fast=fast, encoder=encoder,
+                                         cache=cache, threads=threads, full_size=full_size)
+            out = output_path.with_suffix(".jpg")
+            msg = f"{ext.upper().lstrip('.')}->JPEG->OK: {input_path} -> {out.name}"
+
+        else:
+            data = save_jpeg_under_limit(base, limit_bytes, exif_bytes, icc, min_side=min_side, fast=fast, encoder=encoder,
+                                         cache=cache, threads=threads, full_size=full_size)
+            out = output_path.with_suffix(".jpg")
+            msg = f"OTHER->JPEG->OK: {input_path} -> {out.name}"
+
+        ensure_dir(out)
+        with open(out, "wb") as f:
+            f.write(data)
+        return True, msg
 
     except Exception as e:
         return False, f"FAIL: {input_path} ({e})"
 
-def walk_and_compress(src: Path, dst: Path, limit_mb: float, min_side: int, orient_strategy: str):
+def process_file(in_path: Path, out_path: Path, limit_bytes: int, min_side: int, orient_strategy: str,
+                 fast: bool = False, encoder: str = "pil", cache_dir: Path | None = None,
+                 threads: int = 1, fmt: str = "webp") -> tuple[bool, str]:
+    """进程池 worker：非图片直接复制，图片交给 compress_one。"""
+    if not is_image_file(in_path):
+        try:
+            ensure_dir(out_path)
+            shutil.copy2(in_path, out_path)
+            return True, f"COPY (non-image): {in_path}"
+        except Exception as e:
+            return False, f"FAIL COPY: {in_path} ({e})"
+    return compress_one(in_path, out_path, limit_bytes, min_side=min_side, orient_strategy=orient_strategy,
+                        fast=fast, encoder=encoder, cache_dir=cache_dir, threads=threads, fmt=fmt)
+
+def compress_batch(batch: tuple[str, str, list[str]], limit_bytes: int, min_side: int, orient_strategy: str,
+                   fast: bool = False, encoder: str = "pil", cache_dir: Path | None = None,
+                   threads: int = 1, fmt: str = "webp") -> tuple[int, int, list[str]]:
+    """进程池 worker：处理同一目录下的一批文件，返回 (成功数, 失败数, 输出行)。"""
+    src_dir, dst_dir, names = batch
+    ok = fail = 0
+    lines = []
+    for name in names:
+        success, msg = process_file(Path(src_dir, name), Path(dst_dir, name), limit_bytes, min_side, orient_strategy, fast, encoder,
+                                    cache_dir, threads, fmt)
+        gc.collect()   # 每个文件处理完立即回收，避免多个大图的缓冲区在 worker 里叠加
+        lines.append(msg)
+        ok += int(success)
+        fail += int(not success)
+    return ok, fail, lines
+
+def iter_dirs(root: str, rel: str = ""):
+    """
+    用 os.scandir 递归遍历，自上而下逐目录产出 (目录路径, 相对 src 的路径, [文件名])。
+    目录判断复用 DirEntry 缓存的类型信息，相对路径直接拼字符串，不再构造 Path 和调用 relative_to。
+    与 os.walk 一致：不进入符号链接目录，无法读取的目录跳过。
+    """
+    files, subdirs = [], []
+    try:
+        with os.scandir(root) as it:
+            for entry in it:
+                if entry.is_dir():
+                    if not entry.is_symlink():
+                        subdirs.append(entry)
+                else:
+                    files.append(entry.name)
+    except OSError:
+        return
+    yield root, rel, files
+    for d in subdirs:
+        yield from iter_dirs(d.path, rel + d.name + os.sep)
+
+def walk_and_compress(src: Path, dst: Path, limit_mb: float, min_side: int, orient_strategy: str,
+                      workers: int | None = None, fast: bool = False, encoder: str = "pil",
+                      cache_dir: Path | None = None, threads: int = 1, fmt: str = "webp",
+                      cache_size_gb: float = 2.0):
     limit_bytes = int(limit_mb * 1024 * 1024)
-    total = ok = fail = 0
-    for root, _, files in os.walk(src):
-        for name in files:
-            total += 1
-            in_path = Path(root) / name
-            rel = in_path.relative_to(src)
-            out_path = (dst / rel)
-
-            if not is_image_file(in_path):
-                try:
-                    ensure_dir(out_path)
-                    shutil.copy2(in_path, out_path)
-                    ok += 1
-                    print(f"COPY (non-image): {in_path}")
-                except Exception as e:
-                    fail += 1
-                    print(f"FAIL COPY: {in_path} ({e})")
-                continue
-
-            success, msg = compress_one(in_path, out_path, limit_bytes, min_side=min_side, orient_strategy=orient_strategy)
-            print(msg)
-            ok += int(success)
-            fail += int(not success)
+    dirs = []
+    for root, rel, files in iter_dirs(str(src)):
+        if files:
+            dirs.append((root, os.path.join(str(dst), rel), files))
+    total = sum(len(files) for _, _, files in dirs)
+
+    # 按目录分批，每个任务只传 (源目录, 目标目录, [文件名])，减少进程间序列化和调度开销；
+    # 文件少时缩小批次，保证每个进程大约能分到 4 批
+    if not workers:
+        # AVIF 编码占内存多，默认只用一半的核
+        workers = max(1, (os.cpu_count() or 1) // 2) if fmt == "avif" else (os.cpu_count() or 1)
+    size = max(1, min(BATCH_SIZE, math.ceil(total / (workers * 4))))
+    batches = [(root, dst_dir, files[i:i + size])
+               for root, dst_dir, files in dirs
+               for i in range(0, len(files), size)]
+
+    ok = fail = 0
+    # 每个文件相互独立且编码是 CPU 密集型，用进程池铺满所有核
+    with ProcessPoolExecutor(max_workers=workers) as ex:
+        worker = partial(compress_batch, limit_bytes=limit_bytes, min_side=min_side,
+                         orient_strategy=orient_strategy, fast=fast, encoder=encoder, cache_dir=cache_dir,
+                         threads=threads, fmt=fmt)
+        for n_ok, n_fail, lines in ex.map(worker, batches, chunksize=1):
+            for msg in lines:
+                print(msg)
+            ok += n_ok
+            fail += n_fail
+
+    if cache_dir:
+        prune_cache(cache_dir, int(cache_size_gb * 1024 ** 3))
 
     print("\n=== Summary ===")
     print(f"Source: {src}")
@@ -209,13 +844,26 @@ def walk_and_compress(src: Path, dst: Path, limit_mb: float, min_side: int, orie
     print(f"Total : {total} | OK: {ok} | FAIL: {fail}")
 
 def main():
-    ap = argparse.ArgumentParser(description="Compress images; PNG->WebP (alpha), others->JPEG. Orientation fixed.")
+    ap = argparse.ArgumentParser(description="Compress images; PNG->WebP/AVIF (alpha), others->JPEG. Orientation fixed.")
     ap.add_argument("--src", type=str, required=True, help="Source folder (e.g., ./gallery)")
     ap.add_argument("--dst", type=str, required=True, help="Output folder (e.g., ./gallery_5MB)")
     ap.add_argument("--limit", type=float, default=5.0, help="Max size per image in MB (default: 5)")
     ap.add_argument("--min-side", type=int, default=800, help="Do not scale below this shorter side (default: 800px)")
+    ap.add_argument("--format", type=str, choices=["webp","avif"], default="webp",
+                    help="Output for PNG: webp (default) or avif (avif also takes any image with alpha)")
     ap.add_argument("--orientation", type=str, choices=["auto","force","strip"], default="auto",
                     help="Orientation fix strategy: auto (default), force (always rotate by EXIF), strip (no rotate, set Orientation=1)")
+    ap.add_argument("--fast", action="store_true",
+                    help="Faster JPEG encoding: no optimize/progressive (~2x faster per encode, files 5-13%% larger)")
+    ap.add_argument("--encoder", type=str, choices=["pil","cv2"], default="pil",
+                    help="JPEG encoder: pil (default) or cv2 (OpenCV/libjpeg-turbo, needs opencv-python)")
+    ap.add_argument("--cache-dir", type=str, default=None,
+                    help="Cache downscaled images here to speed up re-runs with a different --limit (needs numpy)")
+    ap.add_argument("--cache-size", type=float, default=2.0,
+                    help="Max --cache-dir size in GB; least recently used entries are evicted after each run (default: 2)")
+    ap.add_argument("--workers", type=int, default=None, help="Worker processes (default: CPU count)")
+    ap.add_argument("--threads", type=int, default=1,
+                    help="Threads per worker for concurrent quality probes (default: 1; e.g. --workers 1 --threads 3 for few large images)")
     args = ap.parse_args()
 
     src = Path(args.src).resolve()
@@ -224,9 +872,21 @@ def main():
     if not src.exists():
         print(f"Source folder not found: {src}")
         sys.exit(1)
+    if args.encoder == "cv2" and cv2 is None:
+        print("--encoder cv2 requires opencv-python (pip install opencv-python)")
+        sys.exit(1)
+    if args.format == "avif" and not avif_supported():
+        print("--format avif requires Pillow >= 11.3 with AVIF support or pillow-avif-plugin")
+        sys.exit(1)
+    if args.cache_dir and np is None:
+        print("--cache-dir requires numpy (pip install numpy)")
+        sys.exit(1)
+    cache_dir = Path(args.cache_dir).resolve() if args.cache_dir else None
     dst.mkdir(parents=True, exist_ok=True)
 
-    walk_and_compress(src, dst, args.limit, args.min_side, args.orientation)
+    walk_and_compress(src, dst, args.limit, args.min_side, args.orientation, workers=args.workers, fast=args.fast,
+                      encoder=args.encoder, cache_dir=cache_dir,
+                      threads=args.threads, fmt=args.format, cache_size_gb=args.cache_size)
 
 if __name__ == "__main__":
     main()